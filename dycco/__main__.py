@@ -5,9 +5,17 @@ import sys
 from .dycco import document
 
 
-def main(paths, output_dir, use_ascii:bool, escape_html:bool, single_file:bool):
+def positive_int(value:str) -> int:
+    """An `argparse` type for options that must be a whole number of 1 or more."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not %d' % number)
+    return number
+
+
+def main(paths, output_dir, use_ascii:bool, escape_html:bool, single_file:bool, jobs:int = None):
     try:
-        document(paths, output_dir, use_ascii, escape_html, single_file)
+        document(paths, output_dir, use_ascii, escape_html, single_file, jobs)
     except IOError as e:
         logging.error('Unable to open file: %s', e)
         return 1
@@ -28,6 +36,9 @@ if __name__ == '__main__':
         help='Run the documentation through html.escape() before markdown or asciidoc3')
     arg_parser.add_argument('-f', '--single-file', action='store_true', default=False, dest='single_file',
         help='Just produce a .md or .adoc file in single-column to be processed externally')
+    arg_parser.add_argument('-j', '--jobs', type=positive_int, default=None, dest='jobs',
+        help='Number of processes to document files with (defaults to one per CPU)')
 
     args = arg_parser.parse_args()
-    sys.exit(main(args.source_file, args.output_dir, args.use_ascii, args.escape_html, args.single_file))
+    sys.exit(main(args.source_file, args.output_dir, args.use_ascii, args.escape_html, args.single_file,
+                  args.jobs))
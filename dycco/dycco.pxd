@@ -0,0 +1,14 @@
+# Cython declarations for compiling `dycco.py` in "pure Python" mode.
+#
+# Nothing here changes how `dycco.py` behaves when run as plain Python; when
+# Cython is available at install time `setup.py` compiles the module, using
+# these types to speed up the line-by-line loop in `parse_code()`.
+
+import cython
+
+
+@cython.locals(i=cython.Py_ssize_t, index=cython.Py_ssize_t, skip_index=cython.Py_ssize_t,
+               decorator_count=cython.Py_ssize_t, skip_starts=list, skip_ends=list,
+               content=list, next_content=list, line=str, stripped=str, comment=str,
+               comment_text=str)
+cpdef parse_code(str src, object sections, list skip_lines)
@@ -24,8 +24,9 @@ code line-by-line to extract comments.
 
 Dycco's HTML and CSS are taken straight from [Docco][docco], but, like
 Pycco, Dycco uses [Mustache][mustache] templates rendered by
-[Pystache][pystache]. The first version of Dycco's templates and CSS were
-taken straight from [Pycco][pycco], then updated to match the latest changes
+[Pystache][pystache] (or by the faster [Mystace][mystace], if it is
+installed). The first version of Dycco's templates and CSS were taken straight
+from [Pycco][pycco], then updated to match the latest changes
 to [Docco][docco]'s.
 
 [docco]: https://ashkenas.com/docco/
@@ -36,39 +37,37 @@ to [Docco][docco]'s.
 [mustache]: https://github.com/peterldowns/python-mustache
 [pystache]: https://github.com/defunkt/pystache
 [asciidoc3]: https://asciidoc3.org/
+[mystace]: https://github.com/eliotwrobson/mystace
 [newpycco]: https://github.com/rojalator/pycco
 """
 
 import ast
+import bisect
 import datetime
+import functools
 import os
 import re
 import shutil
 import io
 from collections import defaultdict
 import html
+import importlib.util
 
-import markdown
-import pystache
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
-
-# We have to muck about a bit because of asciidoc3's strange behaviour
-# See: [AttributeError: module 'asciidoc3' has no attribute 'messages'](https://gitlab.com/asciidoc3/asciidoc3/-/issues/5)
-# for the explanation
+# Markdown, Pystache (or Mystace), Pygments and asciidoc3 are all imported
+# when they are first needed rather than here, so that, for example,
+# `dycco --help` or a `single_file` run doesn't pay for loading the lot.
 
-import importlib.util
 
-ascii_location = None
-ascii_module = importlib.util.find_spec('asciidoc3')
-if ascii_module:
-    # We found a version of asciidoc3, so record where it is for later use by `preprocess_docs()`
-    ascii_location = ascii_module.submodule_search_locations[0] + '/asciidoc3.py'
-    import asciidoc3.asciidoc3api as AsciiDoc3API
+# This is used on the first lines of every file, so compile it once up front.
+CODING_RE = re.compile(r'coding[:=]')
 
+# Placed between code sections when they are highlighted together, so that the
+# resulting HTML can be split up again.
+SECTION_SENTINEL = '# dycco-section-break-5f0c9a2e'
 
-COMMENT_PATTERN = r'^\s*#'
+# Placed between sections' docs when they are escaped together. Python source
+# can't contain a null character, so only a (very odd) docstring could.
+DOCS_SEPARATOR = '\x00'
 
 DYCCO_ROOT = os.path.dirname(__file__)
 DYCCO_RESOURCES = os.path.join(DYCCO_ROOT, 'resources')
@@ -79,7 +78,7 @@ DYCCO_CSS = os.path.join(DYCCO_RESOURCES, 'dycco.css')
 ### Documentation Generation
 
 def document(input_paths, output_dir, use_ascii:bool = False, escape_html:bool = False,
-             single_file:bool = False):
+             single_file:bool = False, jobs:int = 1):
     """Generates documentation for the Python files at the given `input_paths`
     by parsing each file into pairs of documentation and source code and
     rendering those pairs into an HTML file.
@@ -99,16 +98,26 @@ def document(input_paths, output_dir, use_ascii:bool = False, escape_html:bool =
     markdown or asciidoc3 indicators. This is handy if, for example, you haven't
     got the Python asciidoc3 but have got asciidoctor available: you can pass it
     the file for processing.
+
+    `jobs` is the number of processes to spread the files across, or `None`
+    for one per CPU. It's 1 (no extra processes) by default, as the processes
+    may need starting afresh (the `spawn` start method, as on macOS and
+    Windows), which only works if the calling script protects its
+    top-level code with an `if __name__ == '__main__':` guard. Anything less
+    than 1 raises a `ValueError`.
     """
+    if jobs is not None and jobs < 1:
+        raise ValueError('jobs must be at least 1 (or None for one per CPU), not %r' % (jobs,))
 
     # If we get a single path, stick it in a list so we can still pretend
     # we're operating on multiple paths.
     if isinstance(input_paths, str):
         input_paths = [input_paths]
+    else:
+        input_paths = list(input_paths)
 
     # Make sure the directory exists
-    if not os.path.exists(output_dir) or not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
 
     # Parse each input file into sections, render the sections as HTML into a
     # string, and create or overwrite the documentation at the appropriate
@@ -118,20 +127,46 @@ def document(input_paths, output_dir, use_ascii:bool = False, escape_html:bool =
         # ...but if we are wanting a single file, use Markdown's or
         # Asciidoc3's extensions
         extension = 'adoc' if use_ascii else 'md'
-    for input_path in input_paths:
-        filename = os.path.basename(input_path)
-        output_path = make_output_path(filename, output_dir, extension)
-        with open(input_path) as f_input:
-            src = f_input.read()
-            sections = parse(src)
-            output_body = render(filename, sections, use_ascii, escape_html, single_file)
-            with open(output_path, 'w') as f_output:
-                f_output.write(output_body)
+
+    # Each file is independent of the others, so if we've been asked to (and
+    # have more than one file) we spread them across a pool of processes.
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    workers = min(len(input_paths), jobs)
+    if workers > 1:
+        process_file = functools.partial(document_file, output_dir=output_dir, extension=extension,
+                                         use_ascii=use_ascii, escape_html=escape_html,
+                                         single_file=single_file)
+        # Starting processes means loading `multiprocessing`, which isn't
+        # cheap, so only import it when we need it
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Use `list()` to make sure that any exceptions get raised here
+            list(executor.map(process_file, input_paths))
+    else:
+        for input_path in input_paths:
+            document_file(input_path, output_dir, extension, use_ascii, escape_html, single_file)
 
     # Copy the CSS file into the output directory
     shutil.copy(DYCCO_CSS, output_dir)
 
 
+def document_file(input_path, output_dir, extension:str = 'html', use_ascii:bool = False,
+                  escape_html:bool = False, single_file:bool = False):
+    """Generates the documentation for the single Python file at `input_path`,
+    writing it to `output_dir` with the given `extension`. The other params
+    are as for `document()`, which calls this for each of its `input_paths`.
+    """
+    filename = os.path.basename(input_path)
+    output_path = make_output_path(filename, output_dir, extension)
+    with open(input_path) as f_input:
+        src = f_input.read()
+        sections = parse(src)
+        output_body = render(filename, sections, use_ascii, escape_html, single_file)
+        with open(output_path, 'w') as f_output:
+            f_output.write(output_body)
+
+
 ### Parsing the Source
 
 def parse(src:str) -> defaultdict:
@@ -164,8 +199,8 @@ def parse(src:str) -> defaultdict:
     # code and documentation.
     sections = make_sections()
 
-    # First, parse all of the docstrings and get a list (set) of lines we should
-    # skip when parsing the rest of the code. Modifies `sections` in place.
+    # First, parse all of the docstrings and get a list of the `(start, end)`
+    # line ranges we should skip when parsing the rest of the code. Modifies `sections` in place.
     skip_lines = parse_docstrings(src, sections)
 
     # Second, parse the rest of the code, adding code and comments to the
@@ -177,10 +212,11 @@ def parse(src:str) -> defaultdict:
 
 #### First Pass
 
-def parse_docstrings(src:str, sections:defaultdict) -> set:
+def parse_docstrings(src:str, sections:defaultdict) -> list:
     """Parse the given `src` to find any docstrings, add them to the
-    appropriate place in `sections`, and return a `set` of line numbers where
-    the docstrings are. **Note:** Modifies `sections` in place.
+    appropriate place in `sections`, and return a sorted `list` of the
+    `(start, end)` line ranges (inclusive) where the docstrings are.
+    **Note:** Modifies `sections` in place.
     """
     # Find any docstrings in the source code by walking its AST.
     visitor = DocStringVisitor()
@@ -191,43 +227,60 @@ def parse_docstrings(src:str, sections:defaultdict) -> set:
     for target_line, doc in visitor.docstrings.items():
         sections[target_line]['docs'].append(doc)
 
-    return visitor.docstring_lines
+    return sorted(visitor.docstring_lines)
 
 
 #### Second Pass
 
-def parse_code(src:str, sections:defaultdict, skip_lines:set):
+def parse_code(src:str, sections:defaultdict, skip_lines:list):
     """Parse the given `src` line by line to gather source code and comments
-    into the appropriate places in `sections`. Any line numbers in
-    `skip_lines` are skipped. **Note:** Modifies `sections` in place.
+    into the appropriate places in `sections`. Any lines in the sorted
+    `(start, end)` ranges in `skip_lines` are skipped. **Note:** Modifies
+    `sections` in place.
     """
+    # Split the ranges up so that we can find the one a line might be in
+    # with a binary search.
+    skip_starts = [start for start, end in skip_lines]
+    skip_ends = [end for start, end in skip_lines]
+
     # Iterate through each line of source code to gather up comments and code
     # listings and add them to the sections structure.
     current_comment = None
     current_section = None
-    for i, line in enumerate(src.splitlines()):
+    # The number of decorators at the very end of each section's code, which
+    # will need moving to the start of the next section (see below).
+    trailing_decorators = defaultdict(int)
+    # Lines are read from a `StringIO` one at a time rather than splitting
+    # the whole of `src` into a list up front.
+    for i, line in enumerate(io.StringIO(src)):
+        line = line.rstrip('\r\n')
         # Skip any lines that were in docstrings
-        if i in skip_lines or should_filter(line, i):
+        skip_index = bisect.bisect_right(skip_starts, i) - 1
+        if (skip_index >= 0 and i <= skip_ends[skip_index]) or should_filter(line, i):
             continue
 
         # Are we looking at a comment? If so, and we do not have a current
         # comment block, we're starting a new section. If we do have a current
         # comment block, we just add this comment to it (e.g. multi-line
-        # comments).
-        if re.match(COMMENT_PATTERN, line):
-            comment = re.sub(COMMENT_PATTERN, '', line)
+        # comments). The lines of a comment block are gathered in a list and
+        # only joined up once the block is finished. A plain string test is all
+        # we need to spot a comment - no regular expressions.
+        stripped = line.lstrip()
+        if stripped.startswith('#'):
+            comment = stripped[1:]
             if current_comment is None:
-                current_comment = comment
+                current_comment = [comment]
             else:
-                current_comment += '\n' + comment
+                current_comment.append(comment)
 
         # Otherwise, we're looking at a line of code and we need to add it to
         # the appropriate section, along with any preceding comments.
         else:
             # If we have a current comment, that means we're starting a new
             # section with this line of code.
-            if current_comment:
-                current_comment = current_comment.strip()
+            comment_text = '\n'.join(current_comment) if current_comment else ''
+            if comment_text:
+                comment_text = comment_text.strip()
                 docs = sections[i]['docs']
                 # If we've already got docs for this section, that (hopefully)
                 # means we're looking at a function/class def that has a
@@ -235,9 +288,9 @@ def parse_code(src:str, sections:defaultdict, skip_lines:set):
                 # this case, we prepend the comments, so they come before the
                 # docstring.
                 if docs:
-                    docs.insert(0, current_comment)
+                    docs.insert(0, comment_text)
                 else:
-                    docs.append(current_comment)
+                    docs.append(comment_text)
                 # The next comment we encounter will start a new section, but
                 # any lines of code that follow this one belong to this
                 # section.
@@ -263,6 +316,10 @@ def parse_code(src:str, sections:defaultdict, skip_lines:set):
             # which will not have a current section.
             if current_section is not None:
                 sections[current_section]['code'].append(line)
+                if stripped.startswith('@'):
+                    trailing_decorators[current_section] += 1
+                else:
+                    trailing_decorators[current_section] = 0
 
     #### Decorators
     # Now we need to jiggle any decorators about - they should not be at the end of
@@ -275,24 +332,26 @@ def parse_code(src:str, sections:defaultdict, skip_lines:set):
     # We'll now have an ordered list of just the section *numbers* like `[3, 14, 17, 22, 85]`
     # We don't check the last one (`85` in this example) as we cannot bump content
     # *from* it only *into* it
-    for this_section_number in section_numbers[:-1]:
-        # Get what would be the next section number: find where *we* are and add one to it
-        # so, if we were `14` in `[3, 14, 17, 22, 85]` we'd be at `1`, but want the position of
-        # the next section which is at `2`
-        next_index = section_numbers.index(this_section_number) + 1
-        # And then we want the value that's there (`17` in this example)
-        next_section_number = section_numbers[next_index]
-        # We move back 'up' the code content, moving any trailing decorators to the next section.
+    for index, this_section_number in enumerate(section_numbers[:-1]):
+        # Get what would be the next section number: if we were `14` in
+        # `[3, 14, 17, 22, 85]` we'd be at `1`, but want the value at the next
+        # position, `2` (`17` in this example)
+        next_section_number = section_numbers[index + 1]
+        # We counted any trailing decorators as we went, so bail out if there
+        # are none...
+        decorator_count = trailing_decorators[this_section_number]
+        if not decorator_count:
+            continue
         content = sections[this_section_number]['code']
-        for line in reversed(content):
-            # Bail out if there are none, or we've used them all up...
-            if not line.strip().startswith('@'):
-                break
-            # ...Otherwise, remove the last entry from our section's code...
-            s = sections[this_section_number]['code'].pop()
-            # ...and add it to the **start** of the *next* section's code - doing it this
-            # way also preserves the order of the decorators.
-            sections[next_section_number]['code'].insert(0, s)
+        next_content = sections[next_section_number]['code']
+        # ...if the next section's code is nothing *but* decorators, the ones
+        # we move will be trailing decorators of that section too...
+        if trailing_decorators[next_section_number] == len(next_content):
+            trailing_decorators[next_section_number] += decorator_count
+        # ...then move them from the end of our section's code to the
+        # **start** of the *next* section's code, preserving their order.
+        next_content[:0] = content[-decorator_count:]
+        del content[-decorator_count:]
 
 ### Rendering
 
@@ -304,49 +363,77 @@ def render(title:str, sections:defaultdict, use_ascii:bool = False,
     If `single_file` is True, we don't actually run things through Pygments,
     Markdown or Asciidoc3, but just output a single file with a suitable extension
     """
-    # Transform the `sections` `dict` we were given into a format suitable for
-    # our Mustache template. Along the way, preprocess each block of
-    # documentation via Markdown or Asciidoc3 and code via Pygments.
+    items = sorted(sections.items())
+
+    # Join up each section's docs and, if they need sanitizing, escape the
+    # lot in one go rather than a section at a time.
+    docs_blocks = [collate_docs(value['docs']) for key, value in items]
+    if escape_html:
+        docs_blocks = escape_docs_blocks(docs_blocks)
+
+    if single_file:
+        # For a `single_file` we just weld all the gubbins together, writing
+        # them straight into a buffer. The code sections will be marked as
+        # such via `preprocess_code()`
+        out_text = io.StringIO()
+        for index, ((key, value), docs) in enumerate(zip(items, docs_blocks)):
+            if index:
+                out_text.write('\n')
+            out_text.write(preprocess_docs([docs], use_ascii, False, single_file))
+            out_text.write('\n\n\n')
+            out_text.write(preprocess_code(value['code'], use_ascii, single_file))
+        return out_text.getvalue()
+
+    # ...otherwise, we carry on as before, transforming the `sections` `dict`
+    # we were given into a format suitable for our Mustache template. Along
+    # the way, preprocess each block of documentation via Markdown or
+    # Asciidoc3 and code via Pygments.
+    #
+    # All of the code goes through Pygments in one go, rather than a section
+    # at a time.
+    code_blocks = preprocess_code_sections([value['code'] for key, value in items])
+    # Setting up asciidoc3 or Markdown isn't cheap (a `Markdown` object
+    # compiles all of its patterns when it is created), so we do it once for
+    # the whole file rather than for every section.
+    asciidoc = md = None
+    if use_ascii:
+        asciidoc = make_asciidoc()
+    else:
+        import markdown
+        md = markdown.Markdown()
     sections = [{
         'num': key,
-        'docs_html': preprocess_docs(value['docs'], use_ascii, escape_html, single_file),
-        'code_html': preprocess_code(value['code'], use_ascii, single_file)
-    } for key, value in sorted(sections.items())]
+        'docs_html': preprocess_docs([docs], use_ascii, False, asciidoc=asciidoc, md=md),
+        'code_html': code_html
+    } for (key, value), docs, code_html in zip(items, docs_blocks, code_blocks)]
 
     # We include a timestamp in the footer.
-    date = datetime.datetime.utcnow().strftime('%d %b %Y')
+    date = format_date(datetime.datetime.now(datetime.timezone.utc).date())
 
-    if single_file:
-        # For a `single_file` we just weld all the gubbins together, the code
-        # sections will have been marked as such via `preprocess_code()`
-        out_lines = []
-        for section in sections:
-            out_lines.extend([section['docs_html'], '\n', section['code_html']])
-        out_text = '\n'.join(out_lines)
-        return out_text
-    else:
-        # ...otherwise, we carry on as before, rendering via pystache and the template
-        context = {
-            'title': title,
-            'sections': sections,
-            'date': date,
-            }
-        with open(DYCCO_TEMPLATE) as f:
-            return pystache.render(f.read(), context)
+    # Then render via the template
+    context = {
+        'title': title,
+        'sections': sections,
+        'date': date,
+        }
+    return get_template()(context)
 
 
 ### Preprocessors
 
-def preprocess_docs(docs:list, use_ascii:bool, escape_html:bool, raw:bool = False) -> str:
+def preprocess_docs(docs:list, use_ascii:bool, escape_html:bool, raw:bool = False,
+                    asciidoc=None, md=None) -> str:
     """Preprocess the given `docs`, which should be a `list` of strings, by
     joining them together and running them through Markdown or
     asciidoc3, unless `raw` is True, in which case we just return the text
+
+    If you are processing many sections, pass in an `asciidoc` from
+    `make_asciidoc()` or a `markdown.Markdown` object as `md` to be reused,
+    otherwise a new one is made each time.
     """
     assert isinstance(docs, list)
     # Join the documentation sections together.
-    # Sometimes we have `None` in entries - filter them out
-    # while we do so.
-    collated_docs = '\n\n'.join(filter(None, docs))
+    collated_docs = collate_docs(docs)
     # Sanitize it if required
     sanitized_docs = html.escape(collated_docs) if escape_html else collated_docs
     if raw:
@@ -354,19 +441,12 @@ def preprocess_docs(docs:list, use_ascii:bool, escape_html:bool, raw:bool = Fals
         return sanitized_docs
     if use_ascii:
         #### Documentation - Asciidoc3
-        # If we couldn't find asciidoc3, bail out with an error
-        if ascii_location is None:
-            raise ImportError('asciidoc3 was not found')
+        if asciidoc is None:
+            asciidoc = make_asciidoc()
 
         # Asciidoc3 likes file-like entities, so give it them
         dummy_infile = io.StringIO(sanitized_docs)
         dummy_outfile = io.StringIO()
-        # We have to force-feed asciidoc3 with its location (`ascii_location`)
-        # or it will choke and claim things are missing - this is
-        # especially true in virtual environments using `pip`.
-        # See [issue 5](https://gitlab.com/asciidoc3/asciidoc3/-/issues/5).
-        asciidoc = AsciiDoc3API.AsciiDoc3API(ascii_location)
-        asciidoc.options('--no-header-footer')
         # Call asciidoc - the output will be in `dummy_outfile`...
         asciidoc.execute(dummy_infile, dummy_outfile, backend='html5')
         # ...so return its content
@@ -376,7 +456,32 @@ def preprocess_docs(docs:list, use_ascii:bool, escape_html:bool, raw:bool = Fals
 
         # Otherwise, just pass the joined-up (possibly sanitized)
         # document sections to markdown()
-        return markdown.markdown(sanitized_docs)
+        if md is None:
+            import markdown
+            return markdown.markdown(sanitized_docs)
+        # `reset()` clears out anything left over from the previous section
+        return md.reset().convert(sanitized_docs)
+
+
+def collate_docs(docs:list) -> str:
+    """Joins the given `docs`, which should be a `list` of strings, into one
+    string. Sometimes we have `None` in entries - filter them out while we do
+    so.
+    """
+    return '\n\n'.join(filter(None, docs))
+
+
+def escape_docs_blocks(docs_blocks:list) -> list:
+    """Runs every string in `docs_blocks` through `html.escape()`, with a
+    single call for the lot of them.
+    """
+    escaped = html.escape(DOCS_SEPARATOR.join(docs_blocks)).split(DOCS_SEPARATOR)
+    if len(escaped) != len(docs_blocks):
+        # A docstring must contain our separator (via a `\x00` escape), so
+        # do them one at a time instead.
+        escaped = [html.escape(docs) for docs in docs_blocks]
+    return escaped
+
 
 #### Code - Pygments
 
@@ -407,13 +512,62 @@ def preprocess_code(code:list, use_ascii:bool = False, raw:bool = False, languag
             code_block = '{0}{2}\n{1}\n{0}\n'.format(delimiter, '\n'.join(code), language_name)
         return code_block
     else:
-        # Do what we always used to - pass througn Pygments
-        lexer = get_lexer_by_name("python")
-        formatter = HtmlFormatter()
-        result = highlight('\n'.join(code), lexer, formatter)
+        # Do what we always used to - pass througn Pygments, reusing the same
+        # lexer and formatter for every section
+        from pygments import highlight
+        result = highlight('\n'.join(code), get_lexer(language_name), get_formatter())
         return result
 
 
+def preprocess_code_sections(codes:list, language_name:str = 'python') -> list:
+    """Preprocess a `list` of code sections, each of which is a `list` of
+    strings as for `preprocess_code()`, returning a `list` of the highlighted
+    HTML for each section.
+
+    Rather than calling Pygments once per section, we lex each section, glue
+    the tokens together with a sentinel comment between each section, format
+    the lot in one pass and then split the HTML back up on the sentinel. Each
+    section is still lexed on its own, so one section can't upset the
+    highlighting of the next.
+    """
+    assert isinstance(codes, list)
+    results = [''] * len(codes)
+    # Empty sections stay empty, just as they would with `preprocess_code()`
+    wanted = [n for n, code in enumerate(codes) if code and ''.join(code).strip()]
+    if not wanted:
+        return results
+
+    from pygments import format as format_tokens
+    from pygments.token import Token
+
+    lexer = get_lexer(language_name)
+
+    def tokens():
+        for n in wanted:
+            if n != wanted[0]:
+                yield Token.Comment.Single, SECTION_SENTINEL
+                yield Token.Text.Whitespace, '\n'
+            yield from lexer.get_tokens('\n'.join(codes[n]))
+
+    markers = get_section_markers()
+    if markers is not None:
+        head, separator, tail = markers
+        parts = format_tokens(tokens(), get_formatter()).split(separator)
+        if len(parts) == len(wanted) and parts[0].startswith(head) and parts[-1].endswith(tail):
+            parts[0] = parts[0][len(head):]
+            parts[-1] = parts[-1][:len(parts[-1]) - len(tail)]
+            for n, part in zip(wanted, parts):
+                results[n] = head + part + tail
+            return results
+
+    # Either we couldn't work out the markers, or the code itself contains our
+    # sentinel (unlikely, but possible), so fall back to highlighting a
+    # section at a time.
+    for n in wanted:
+        results[n] = preprocess_code(codes[n], language_name=language_name)
+    return results
+
+
 ### Support Functions
 
 def make_sections() -> defaultdict:
@@ -427,6 +581,102 @@ def make_sections() -> defaultdict:
     return defaultdict(section)
 
 
+@functools.lru_cache(maxsize=None)
+def get_asciidoc() -> tuple:
+    """Finds asciidoc3, returning a `(ascii_location, AsciiDoc3API)` tuple
+    for `preprocess_docs()`, or raises `ImportError` if it isn't installed.
+    """
+    # We have to muck about a bit because of asciidoc3's strange behaviour
+    # See: [AttributeError: module 'asciidoc3' has no attribute 'messages'](https://gitlab.com/asciidoc3/asciidoc3/-/issues/5)
+    # for the explanation
+    ascii_module = importlib.util.find_spec('asciidoc3')
+    if not ascii_module:
+        raise ImportError('asciidoc3 was not found')
+    # We found a version of asciidoc3, so record where it is
+    ascii_location = ascii_module.submodule_search_locations[0] + '/asciidoc3.py'
+    import asciidoc3.asciidoc3api as AsciiDoc3API
+    return ascii_location, AsciiDoc3API
+
+
+def make_asciidoc():
+    """Creates an `AsciiDoc3API` object set up for `preprocess_docs()`. It can
+    be reused for any number of sections.
+    """
+    # If we couldn't find asciidoc3, this will bail out with an error
+    ascii_location, AsciiDoc3API = get_asciidoc()
+    # We have to force-feed asciidoc3 with its location (`ascii_location`)
+    # or it will choke and claim things are missing - this is
+    # especially true in virtual environments using `pip`.
+    # See [issue 5](https://gitlab.com/asciidoc3/asciidoc3/-/issues/5).
+    asciidoc = AsciiDoc3API.AsciiDoc3API(ascii_location)
+    asciidoc.options('--no-header-footer')
+    return asciidoc
+
+
+@functools.lru_cache(maxsize=None)
+def get_template():
+    """Reads and parses the Mustache template at `DYCCO_TEMPLATE`, returning
+    a callable that renders it with a given context. The result is cached, so
+    documenting many files only reads and parses the template once.
+
+    Mystace is used if it is available, otherwise we fall back to Pystache.
+    Mystace is given `html.escape` to escape with, which is what Pystache
+    uses, so that both produce exactly the same HTML (Mystace's own escaping
+    leaves `'` alone).
+    """
+    with open(DYCCO_TEMPLATE) as f:
+        template_src = f.read()
+    try:
+        import mystace
+    except ImportError:
+        import pystache
+        return functools.partial(pystache.Renderer().render, pystache.parse(template_src))
+    return functools.partial(mystace.MustacheRenderer.from_template(template_src).render,
+                             html_escape_fn=html.escape)
+
+
+@functools.lru_cache(maxsize=None)
+def get_lexer(language_name:str = 'python'):
+    """Returns the Pygments lexer for `language_name`. Looking a lexer up by
+    name isn't free, so we only do it once per language.
+    """
+    from pygments.lexers import get_lexer_by_name
+    return get_lexer_by_name(language_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_formatter():
+    """Returns the Pygments `HtmlFormatter` shared by every code section."""
+    from pygments.formatters import HtmlFormatter
+    return HtmlFormatter()
+
+
+@functools.lru_cache(maxsize=None)
+def get_section_markers():
+    """Returns the HTML that `get_formatter()` wraps highlighted code in, and
+    the HTML line our `SECTION_SENTINEL` turns into, as a `(head, separator,
+    tail)` tuple for `preprocess_code_sections()` to split on. Returns `None`
+    if the formatter's output isn't laid out the way we expect.
+    """
+    from pygments import highlight
+    sample = highlight(SECTION_SENTINEL, get_lexer(), get_formatter())
+    try:
+        start = sample.rindex('<span', 0, sample.index(SECTION_SENTINEL))
+        end = sample.index('\n', start) + 1
+    except ValueError:
+        return None
+    return sample[:start], sample[start:end], sample[end:]
+
+
+@functools.lru_cache(maxsize=1)
+def format_date(day:datetime.date) -> str:
+    """Formats `day` for the footer of the rendered HTML. Every file in a run
+    will (almost certainly) be on the same day, so we keep hold of the last
+    one.
+    """
+    return day.strftime('%d %b %Y')
+
+
 def should_filter(line:str, num:int) -> bool:
     """Test the given line to see if it should be included. Excludes shebang
     lines, for now.
@@ -435,7 +685,7 @@ def should_filter(line:str, num:int) -> bool:
     if num == 0 and line.startswith('#!'):
         return True
     # Filter encoding specification comments.
-    if num < 2 and line.startswith('#') and re.search('coding[:=]', line):
+    if num < 2 and line.startswith('#') and CODING_RE.search(line):
         return True
     return False
 
@@ -452,115 +702,95 @@ def make_output_path(filename, output_dir, extension:str = 'html') -> str:
 
 #### AST Parsing
 
-class DocStringVisitor(ast.NodeVisitor):
-    """A `NodeVisitor` subclass that walks an Abstract Syntax Tree (AST) and gathers
-    up and notes the positions of any docstrings it finds.
+class DocStringVisitor(object):
+    """Walks an Abstract Syntax Tree (AST) and gathers up and notes the
+    positions of any docstrings it finds.
+
+    This used to be an `ast.NodeVisitor` subclass, but we only care about
+    module, function and class nodes, so it's quicker to run through the whole
+    tree with `ast.walk` and just pick those out than to dispatch a method
+    call for every node in it.
     """
 
+    # The nodes that might have an associated docstring.
+    DOCSTRING_NODES = (ast.Module, ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)
+
     def __init__(self):
         # Docstrings will be tracked as a dict mapping 0-based target line
         # numbers to cleaned up docstrings.
         self.docstrings = {}
 
-        # Track the line numbers where docstrings are found, so they can be
-        # skipped when processing the source code line-by-line.
-        self.docstring_lines = set()
+        # Track the `(start, end)` line ranges where docstrings are found, so
+        # they can be skipped when processing the source code line-by-line.
+        self.docstring_lines = []
 
-        # Keep track of the current module, class, or function node we're
-        # looking at, if any.
-        self.current_node = None
-        self.current_doc = None
+    def visit(self, tree):
+        """Walk the given `tree`, noting the docstrings of every module,
+        function and class node in it.
+        """
+        for node in ast.walk(tree):
+            if isinstance(node, self.DOCSTRING_NODES):
+                self._visit_docstring_node(node)
 
     def _visit_docstring_node(self, node):
-        """A method to be called when visiting any node that might have an
-        associated docstring (ie, module, function and class nodes). This uses
-        `ast.get_docstring` to grab and sanitize the docstring, and notes
-        which node we're currently looking at.
-        """
-        self.current_node = node
-        self.current_doc = ast.get_docstring(node) or ''
-        # Mark the place of any function or class definitions without
-        # docstrings, to ensure that a new section will be started for every
-        # def when rendering.
-        if isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)) and not self.current_doc:
-            self.docstrings[node.lineno - 1 - len(node.decorator_list)] = None
-        super(DocStringVisitor, self).generic_visit(node)
-
-    # Use the `_visit_docstring_node` method when visiting all of these nodes.
-    visit_Module = _visit_docstring_node
-    visit_FunctionDef = _visit_docstring_node
-    visit_ClassDef = _visit_docstring_node
-    visit_AsyncFunctionDef = _visit_docstring_node
-
-    def visit_Expr(self, node):
-        """We need to actually visit the nodes representing the docstrings to
-        record their positions. Docstring nodes show up as `Expr` nodes whose
-        values are `Str` nodes.
-
-        `ast.Str` was removed in Python 3.8 (well, deprecated and marked for
-        removal), so we need to play around a bit...
-
-        The Python docs state:
-
-        A constant value. The value attribute of the Constant literal contains the Python
-        object it represents. The values represented can be simple types such as a number,
-        string or None, but also immutable container types (tuples and frozensets) if all
-        of their elements are constant.
-
-        ...or in English, the `node.value` **type** will be `ast.Constant` *but* you can get its
-        actual type via `node.value.value` for constant types (`ast.Call` types don't have a
-         `value.value` member).
+        """A method to be called for any node that might have an associated
+        docstring (ie, module, function and class nodes). This uses
+        `ast.get_docstring` to grab and sanitize the docstring, and records
+        its position.
         """
-        if isinstance(node.value, ast.Constant):
-            if isinstance(node.value.value, str) and self.current_node and self.current_doc:
-                # Figure out where the docstring *ends*, accounting for 0-based line numbers.
-                # _Note that modules *have* got an end-line despite what the older code says._
-                end_line = node.end_lineno - 1
-
-                # We need to know how many lines are in the docstring to figure
-                # out where it actually starts. We might have triple-strings of
-                # various combinations:-
-                #
-                # >      """..."""
-                #
-                # or
-                #
-                # >      """...
-                # >      """
-                #
-                #  or
-                #
-                # >      """
-                # >      ..."""
-                #
-                #  or... well, you get the idea!
-
-                # `splitlines()` will handily split on the `\n`, so we can deal with all the above
-                # variants quite easily
-                line_count = len(node.value.s.splitlines())
-                if isinstance(self.current_node, ast.Module):
-                    start_line = end_line - (line_count if line_count > 1 else 0)
-                    target_line = start_line
-
-                # The current node's `lineno` attribute will be where the
-                # function/class definition starts, taking decorators into
-                # account, so there may be a gap between the `target_line` and the
-                # `start_line` if the defintion includes decorators or spans
-                # multiple lines.
-                else:
-                    start_line = end_line - (line_count - 1)
-                    target_line = self.current_node.lineno - 1
-
-                # Mark the positions of this node and its documentation.
-                assert target_line not in self.docstrings
-                self.docstrings[target_line] = self.current_doc.strip()
-                self.docstring_lines.update(range(start_line, end_line + 1))
-
-            # Reset the accounting variables even if we didn't find a docstring,
-            # so that we don't accidentally add "unattached" docstrings to
-            # whatever class/def/module happened to come before them.
-            if self.current_node:
-                self.current_node = None
-                self.current_doc = None
-
-        super(DocStringVisitor, self).generic_visit(node)
+        doc = ast.get_docstring(node) or ''
+        if not doc:
+            # Mark the place of any function or class definitions without
+            # docstrings, to ensure that a new section will be started for
+            # every def when rendering.
+            if not isinstance(node, ast.Module):
+                self.docstrings[node.lineno - 1 - len(node.decorator_list)] = None
+            return
+
+        # `ast.get_docstring` only finds a docstring if the first statement
+        # of the node's body is an `Expr` whose value is an `ast.Constant`
+        # holding a `str` (`ast.Str` went away after Python 3.8), so that's
+        # the node which tells us where the docstring is.
+        docstring_node = node.body[0]
+
+        # Figure out where the docstring *ends*, accounting for 0-based line numbers.
+        # _Note that modules *have* got an end-line despite what the older code says._
+        end_line = docstring_node.end_lineno - 1
+
+        # We need to know how many lines are in the docstring to figure
+        # out where it actually starts. We might have triple-strings of
+        # various combinations:-
+        #
+        # >      """..."""
+        #
+        # or
+        #
+        # >      """...
+        # >      """
+        #
+        #  or
+        #
+        # >      """
+        # >      ..."""
+        #
+        #  or... well, you get the idea!
+
+        # `splitlines()` will handily split on the `\n`, so we can deal with all the above
+        # variants quite easily
+        line_count = len(docstring_node.value.value.splitlines())
+        if isinstance(node, ast.Module):
+            start_line = end_line - (line_count if line_count > 1 else 0)
+            target_line = start_line
+
+        # The node's `lineno` attribute will be where the function/class
+        # definition starts, taking decorators into account, so there may be
+        # a gap between the `target_line` and the `start_line` if the
+        # defintion includes decorators or spans multiple lines.
+        else:
+            start_line = end_line - (line_count - 1)
+            target_line = node.lineno - 1
+
+        # Mark the positions of this node and its documentation.
+        assert target_line not in self.docstrings
+        self.docstrings[target_line] = doc.strip()
+        self.docstring_lines.append((start_line, end_line))
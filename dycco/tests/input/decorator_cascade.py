@@ -0,0 +1,13 @@
+from functools import wraps
+
+
+def identity(function):
+    return function
+
+@identity
+# A comment between the decorators
+@wraps(identity)
+# And another one
+@identity
+def decorated():
+    pass
@@ -0,0 +1,4 @@
+import sys
+
+# Form feeds split pages, not lines
+print(sys.argv)
@@ -1,4 +1,12 @@
+import glob
+import html
+import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
+
+from dycco import dycco
 from utils import with_setup
 
 # Adjusted for Python 3 version - v1.0.2 and above, RJL 2022
@@ -58,6 +66,32 @@ class ParserTests(unittest.TestCase):
                           '',
                           'sys.exit(1)']}})
 
+    @with_setup
+    def test_form_feed(self):
+        # Form feeds don't end lines as far as Python is concerned, so they
+        # mustn't throw the line numbers out of step with the AST's.
+        self.assertEqual(
+            self.results,
+            {0: {'docs': [], 'code': ['import sys', '\x0c']},
+             3: {'docs': ['Form feeds split pages, not lines'],
+                 'code': ['print(sys.argv)\x0c']}})
+
+    @with_setup
+    def test_decorator_cascade(self):
+        # Decorators split up by comments should all end up with the def,
+        # passing through the section made only of decorators on the way.
+        self.assertEqual(
+            self.results,
+            {0: {'docs': [], 'code': ['from functools import wraps', '', '']},
+             3: {'docs': [None], 'code': ['def identity(function):', '    return function', '']},
+             8: {'docs': ['A comment between the decorators', None], 'code': []},
+             10: {'docs': ['And another one'],
+                  'code': ['@identity',
+                           '@wraps(identity)',
+                           '@identity',
+                           'def decorated():',
+                           '    pass']}})
+
     @with_setup
     def test_torturetest(self):
         # The output test has been adjusted slightly - the old code
@@ -123,5 +157,94 @@ class ParserTests(unittest.TestCase):
                            '']}})
 
 
+class PreprocessTests(unittest.TestCase):
+
+    def setUp(self):
+        # Clear the cached markers, so patching them takes effect
+        dycco.get_section_markers.cache_clear()
+        self.addCleanup(dycco.get_section_markers.cache_clear)
+
+    def assertSameAsPerSection(self, codes):
+        self.assertEqual(
+            dycco.preprocess_code_sections(codes),
+            [dycco.preprocess_code(code) for code in codes])
+
+    def test_code_sections(self):
+        self.assertSameAsPerSection([
+            ['import sys', ''],
+            ['def foo(a, b):', '    \'\'\'Not a docstring', '# in a string'],
+            ['    \'\'\'', '    return a + b  # a comment'],
+            ['@property', 'class Foo(object):', '    pass', '', '']])
+
+    def test_empty_code_sections(self):
+        self.assertSameAsPerSection([[], ['x = 1'], [''], ['   ', ''], ['y = 2']])
+        self.assertEqual(dycco.preprocess_code_sections([[], ['']]), ['', ''])
+        self.assertEqual(dycco.preprocess_code_sections([]), [])
+
+    def test_code_containing_sentinel(self):
+        self.assertSameAsPerSection([
+            ['x = 1', dycco.SECTION_SENTINEL, 'y = 2'],
+            [dycco.SECTION_SENTINEL],
+            ['z = 3']])
+
+    def test_unexpected_formatter_output(self):
+        from pygments.formatters import NullFormatter
+        with mock.patch.object(dycco, 'get_formatter', return_value=NullFormatter()):
+            self.assertIsNone(dycco.get_section_markers())
+
+    def test_no_section_markers(self):
+        with mock.patch.object(dycco, 'get_section_markers', return_value=None):
+            self.assertSameAsPerSection([['x = 1'], ['y = 2']])
+
+    def test_escape_docs_blocks(self):
+        blocks = ['<b>Bold</b> & "quoted"', '', "it's", 'plain']
+        self.assertEqual(dycco.escape_docs_blocks(blocks), [html.escape(block) for block in blocks])
+
+    def test_escape_docs_blocks_containing_separator(self):
+        # A docstring with a `\x00` escape in it holds our separator
+        src = 'def foo():\n    "Null \\x00 <here>"\n'
+        blocks = [dycco.collate_docs(section['docs']) for key, section in sorted(dycco.parse(src).items())]
+        self.assertIn('\x00', blocks[0])
+        blocks.append('<after>')
+        self.assertEqual(dycco.escape_docs_blocks(blocks), [html.escape(block) for block in blocks])
+
+
+class DocumentTests(unittest.TestCase):
+
+    def setUp(self):
+        self.input_paths = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'input', '*.py')))
+        self.output_dir = self.make_output_dir()
+
+    def make_output_dir(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        return output_dir
+
+    def read_outputs(self, output_dir):
+        outputs = {}
+        for path in self.input_paths:
+            name = os.path.splitext(os.path.basename(path))[0] + '.html'
+            with open(os.path.join(output_dir, name)) as f:
+                outputs[name] = f.read()
+        return outputs
+
+    def test_multiple_files(self):
+        # Any iterable of paths will do, not just a list
+        dycco.document((path for path in self.input_paths), self.output_dir)
+        self.assertEqual(len(self.read_outputs(self.output_dir)), len(self.input_paths))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'dycco.css')))
+
+    def test_multiple_files_in_parallel(self):
+        dycco.document(self.input_paths, self.output_dir)
+        parallel_dir = self.make_output_dir()
+        dycco.document((path for path in self.input_paths), parallel_dir, jobs=2)
+        self.assertEqual(self.read_outputs(parallel_dir), self.read_outputs(self.output_dir))
+
+    def test_bad_jobs(self):
+        for jobs in (0, -1):
+            with self.assertRaises(ValueError):
+                dycco.document(self.input_paths, self.output_dir, jobs=jobs)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,21 @@
 import os
-from distutils.core import setup
+from setuptools import setup
 
 
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
 
+# If Cython is available, compile `dycco.py` (as typed by `dycco.pxd`) for a
+# faster parser. Otherwise, we just install the plain Python module.
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize('dycco/dycco.py', language_level=3)
+
+
 setup(
     name='dycco',
     version='1.0.2',
@@ -29,9 +39,14 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     packages=['dycco'],
+    ext_modules=ext_modules,
     package_data={
-        'dycco': ['resources/*'],
+        'dycco': ['resources/*', 'dycco.pxd'],
     },
     scripts=['bin/dycco'],
     install_requires=read('requirements.txt').splitlines(),
+    extras_require={
+        # Mystace renders the HTML template much faster than Pystache
+        'fast': ['mystace>=1.0'],
+    },
 )